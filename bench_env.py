@@ -0,0 +1,111 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#
+# Copyright 2022 Marek Behún <kabel@kernel.org>
+#
+# Controls of the environment for benchmark runs, to reduce noise: CPU
+# pinning and priorities of the harness and the browser process tree, and
+# checks of CPU frequency scaling and system load. Linux only.
+
+import os
+from glob import glob
+
+# load average above which a warning is given, if no limit is configured
+DEFAULT_MAX_LOAD = 1.0
+
+__all__ = ['DEFAULT_MAX_LOAD', 'parse_cpu_list', 'process_tree', 'pin_and_prioritize', 'snapshot', 'warnings']
+
+def parse_cpu_list(value):
+	cpus = set()
+	for part in value.split(','):
+		if '-' in part:
+			first, last = part.split('-', 1)
+			cpus.update(range(int(first), int(last) + 1))
+		else:
+			cpus.add(int(part))
+	return cpus
+
+def _read(path):
+	try:
+		with open(path) as f:
+			return f.read().strip()
+	except OSError:
+		return None
+
+def _children(pid):
+	res = []
+	for path in glob('/proc/%d/task/*/children' % pid):
+		res += [int(child) for child in (_read(path) or '').split()]
+	return res
+
+# Returns pid and pids of all descendants of process pid
+def process_tree(pid):
+	res = []
+	todo = [pid]
+	while todo:
+		pid = todo.pop()
+		res.append(pid)
+		todo += _children(pid)
+	return res
+
+# Sets CPU affinity and/or nice value of all threads of all processes in the
+# tree rooted at pid. Threads and processes created later inherit them.
+def pin_and_prioritize(pid, cpus=None, nice=None):
+	for process in process_tree(pid):
+		for task in glob('/proc/%d/task/*' % process):
+			tid = int(os.path.basename(task))
+			try:
+				if cpus is not None:
+					os.sched_setaffinity(tid, cpus)
+				if nice is not None:
+					os.setpriority(os.PRIO_PROCESS, tid, nice)
+			except ProcessLookupError:
+				pass
+
+def _governors():
+	res = {}
+	for path in glob('/sys/devices/system/cpu/cpu[0-9]*/cpufreq/scaling_governor'):
+		governor = _read(path)
+		res[governor] = res.get(governor, 0) + 1
+	return res
+
+def _turbo():
+	no_turbo = _read('/sys/devices/system/cpu/intel_pstate/no_turbo')
+	if no_turbo is not None:
+		return no_turbo == '0'
+
+	boost = _read('/sys/devices/system/cpu/cpufreq/boost')
+	if boost is not None:
+		return boost == '1'
+
+	return None
+
+def snapshot(browser_pid=None):
+	res = {
+		'loadavg': os.getloadavg(),
+		'governors': _governors(),
+		'turbo': _turbo(),
+		'harness_cpus': sorted(os.sched_getaffinity(0)),
+		'harness_nice': os.getpriority(os.PRIO_PROCESS, 0),
+	}
+
+	if browser_pid is not None:
+		res['browser_cpus'] = sorted(os.sched_getaffinity(browser_pid))
+		res['browser_nice'] = os.getpriority(os.PRIO_PROCESS, browser_pid)
+
+	return res
+
+# Returns list of reasons why the environment in snapshot env may be noisy
+def warnings(env, max_load=DEFAULT_MAX_LOAD):
+	res = []
+
+	for governor in env['governors']:
+		if governor != 'performance':
+			res.append('CPU frequency governor %s in use on %d CPUs' % (governor, env['governors'][governor]))
+
+	if env['turbo']:
+		res.append('CPU turbo/boost is enabled')
+
+	if env['loadavg'][0] > max_load:
+		res.append('load average %.2f is higher than %.2f' % (env['loadavg'][0], max_load))
+
+	return res
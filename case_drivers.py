@@ -3,18 +3,19 @@
 # Copyright 2022 Marek Behún <kabel@kernel.org>
 
 from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
-import socket, multiprocessing, subprocess, signal, sys
+import socket, multiprocessing, subprocess, signal, sys, json
 from functools import partial
-from time import sleep, strftime
+from time import sleep, strftime, perf_counter
 import pathlib, os
-from shutil import copyfile
 from random import sample
 from glob import glob
 from tempfile import TemporaryDirectory
 from selenium.webdriver import ChromeOptions
 from webdriver import ProfilerWebDriver
+from profile_scratch import merge_profiles, raw_profiles_usage, scratch_usage, ScratchMonitor
+import bench_env, chrome_trace
 
-__all__ = ['CaseDriver', 'CaseDriverWithHttpServer', 'CaseDriverWprRecord', 'CaseDriverWprReplay', 'CHROME_PATH', 'CHROMEDRIVER_PATH', 'ADDITIONAL_ARGUMENTS']
+__all__ = ['CaseDriver', 'batch_cases', 'SharedSession', 'run_batch', 'CaseDriverWithHttpServer', 'CaseDriverWprRecord', 'CaseDriverWprReplay', 'CHROME_PATH', 'CHROMEDRIVER_PATH', 'ADDITIONAL_ARGUMENTS', 'REPEATS', 'CLEAR_CACHE_BETWEEN_REPEATS', 'PROFILE_SCRATCH_DIR', 'PROFILE_SCRATCH_LIMIT', 'PROFILE_ONLINE_MERGE', 'BROWSER_CPUS', 'BROWSER_NICE', 'RECORD_ENVIRONMENT', 'TRACE_DIR', 'TRACE_CATEGORIES']
 
 module_path = pathlib.Path(__file__)
 
@@ -29,23 +30,69 @@ CHROMEDRIVER_PATH = None
 
 ADDITIONAL_ARGUMENTS = []
 
+# how many times to repeat each case's navigation sequence in one session;
+# the first iteration is cold, the others are warm (code cache, HTTP cache,
+# back/forward cache)
+REPEATS = 1
+CLEAR_CACHE_BETWEEN_REPEATS = False
+
+# where to create the temporary directory for raw profile data (e.g. tmpfs),
+# None for the system default
+PROFILE_SCRATCH_DIR = None
+# size in bytes of raw profile data after which finished raw profiles are
+# merged early and removed, None for no limit
+PROFILE_SCRATCH_LIMIT = None
+# if set to N, use LLVM's online merging pool of N files (%Nm pattern) instead
+# of one file per process
+PROFILE_ONLINE_MERGE = None
+
+# CPU set and nice value for the browser process tree (chromedriver and
+# everything it starts), None to leave them alone
+BROWSER_CPUS = None
+BROWSER_NICE = None
+# record environment snapshot (see bench_env.snapshot) when browser starts
+RECORD_ENVIRONMENT = False
+
+# directory where to save Chrome trace of each case run, None to not trace
+TRACE_DIR = None
+TRACE_CATEGORIES = chrome_trace.DEFAULT_CATEGORIES
+
 class CaseDriver:
 	computes_score = False
 
+	# set to True in cases which must not share a browser session with other
+	# cases when batching
+	needs_clean_browser = False
+
 	def browser_args(self):
 		return [
 			#'start-maximized',
 			'window-size=1280,1024',
-			'user-data-dir=%s' % self.userdatadir.name,
 			'disable-notifications',
 		] + ADDITIONAL_ARGUMENTS
 
+	def session_browser_args(self):
+		return [
+			'user-data-dir=%s' % self.userdatadir.name,
+		]
+
 	def enable_backend(self):
 		pass
 
 	def disable_backend(self):
 		pass
 
+	def backend_key(self):
+		return None
+
+	def session_key(self):
+		return (self.backend_key(), tuple(self.browser_args()))
+
+	def share_backend(self, other):
+		# start using the backend of case other, which has the same backend
+		# key. Returns the case which owns the running backend afterwards
+		return other
+
 	def __str__(self):
 		return "%s.%s" % (self.__class__.__module__, self.__class__.__name__)
 
@@ -58,62 +105,146 @@ class CaseDriver:
 		if len(inputs) == 0:
 			raise Exception('no profile data generated')
 
-		temp_output = '%s/temp-merged.profdata' % self.profiledir.name
-
-		args = ['llvm-profdata', 'merge', '-output', temp_output]
-		args += inputs
-		if os.path.isfile(profile):
-			args.append(profile)
-
-		result = subprocess.run(args)
-		if result.returncode != 0:
-			raise Exception('Profile merging failed [return code %d]' % result.returncode)
-
-		if os.path.exists(profile):
-			os.unlink(profile)
-		try:
-			os.rename(temp_output, profile)
-		except OSError:
-			copyfile(temp_output, profile)
+		merge_profiles(inputs, profile, '%s/temp-merged.profdata' % self.profiledir.name)
 
-	def run(self, profile=None):
-		if CHROME_PATH is None or CHROMEDRIVER_PATH is None:
-			raise RuntimeError('CHROME_PATH or CHROMEDRIVER_PATH unset')
+	def report_profile_scratch(self):
+		files, size = raw_profiles_usage(self.profiledir.name)
+		peak = scratch_usage(self.profiledir.name)[1]
+		if self.scratch_monitor:
+			files += self.scratch_monitor.files_written
+			size += self.scratch_monitor.bytes_written
+			peak = max(peak, self.scratch_monitor.peak_usage)
+			print('Merged raw profiles early %d times' % self.scratch_monitor.early_merges)
 
-		self.enable_backend()
+		print('Profile data: %d files, %d bytes written, peak scratch usage %d bytes' % (files, size, peak))
 
+	def start_browser(self, profile=None):
 		self.userdatadir = TemporaryDirectory()
-		self.profiledir = TemporaryDirectory()
+		self.profiledir = TemporaryDirectory(dir=PROFILE_SCRATCH_DIR)
 
 		opts = ChromeOptions()
 		opts.binary_location = CHROME_PATH
 
-		for arg in self.browser_args():
+		for arg in self.browser_args() + self.session_browser_args():
 			opts.add_argument(arg)
 
-		try:
-			os.environ['LLVM_PROFILE_FILE'] = '%s/%%h-%%p.profdata' % self.profiledir.name
+		if PROFILE_ONLINE_MERGE:
+			os.environ['LLVM_PROFILE_FILE'] = '%s/%%%dm.profraw' % (self.profiledir.name, PROFILE_ONLINE_MERGE)
+		else:
+			os.environ['LLVM_PROFILE_FILE'] = '%s/%%h-%%p.profraw' % self.profiledir.name
+
+		if PROFILE_SCRATCH_LIMIT is not None:
+			self.scratch_monitor = ScratchMonitor(self.profiledir.name, PROFILE_SCRATCH_LIMIT, merge=bool(profile))
+			self.scratch_monitor.start()
+		else:
+			self.scratch_monitor = None
 
+		# stop the scratch monitor and remove the temporary directories also
+		# if chromedriver or the browser fails to start
+		self.driver = None
+		try:
 			self.driver = ProfilerWebDriver(
 				executable_path=CHROMEDRIVER_PATH,
 				options=opts
 			)
 
-			self.case_run()
+			browser_pid = self.driver.service.process.pid
+			if BROWSER_CPUS is not None or BROWSER_NICE is not None:
+				bench_env.pin_and_prioritize(browser_pid, BROWSER_CPUS, BROWSER_NICE)
 
-			self.driver.quit()
-			self.userdatadir.cleanup()
+			if RECORD_ENVIRONMENT:
+				self.environment = bench_env.snapshot(browser_pid)
+		except Exception:
+			self.stop_browser()
+			raise
+
+	def stop_browser(self, profile=None):
+		try:
+			try:
+				if self.driver is not None:
+					self.driver.quit()
+			finally:
+				if self.scratch_monitor:
+					self.scratch_monitor.stop()
+			self.report_profile_scratch()
 			if profile:
 				self.merge_profile(profile)
-			self.profiledir.cleanup()
-		except Exception as e:
-			self.driver.quit()
+		finally:
 			self.userdatadir.cleanup()
 			self.profiledir.cleanup()
-			self.disable_backend()
-			raise e
 
-		self.disable_backend()
+	def run_iterations(self):
+		if TRACE_DIR is None:
+			self.run_iterations_untraced()
+			return
+
+		path = '%s/%s-%s.json.gz' % (TRACE_DIR, self, strftime('%Y%m%d-%H%M%S'))
+		try:
+			tracer = chrome_trace.Tracer(self.driver, path, TRACE_CATEGORIES)
+		except Exception as e:
+			# e.g. another tracing session is active
+			print('Tracing of %s failed to start, running untraced: %s' % (self, repr(e)))
+			self.run_iterations_untraced()
+			return
+
+		try:
+			self.run_iterations_untraced()
+		finally:
+			# keep the trace also if the case failed, but do not let tracing
+			# errors (e.g. after browser crash) hide the case's exception
+			try:
+				tracer.stop()
+				self.trace = {'path': path, 'summary': chrome_trace.summarize_trace(path)}
+				print('TRACE[%s] = %s' % (self, json.dumps(self.trace)))
+			except Exception as e:
+				print('Tracing of %s failed: %s' % (self, repr(e)))
+
+	def run_iterations_untraced(self):
+		self.timings = []
+
+		for i in range(REPEATS):
+			if i > 0:
+				# navigate away and back, so that the last page of the
+				# previous iteration is restored from back/forward cache
+				self.driver.get('about:blank')
+				self.driver.back()
+				self.driver.get('about:blank')
+				if CLEAR_CACHE_BETWEEN_REPEATS:
+					self.driver.clear_browser_cache()
+
+			start = perf_counter()
+			self.case_run()
+			self.timings.append(perf_counter() - start)
+
+	def timings_summary(self):
+		res = 'cold %.3f s' % self.timings[0]
+		warm = self.timings[1:]
+		if warm:
+			res += ', warm %.3f s (average of %d, min %.3f s, max %.3f s)' % \
+				(sum(warm) / len(warm), len(warm), min(warm), max(warm))
+		return res
+
+	def adopt_session(self, other):
+		self.driver = other.driver
+		self.userdatadir = other.userdatadir
+		self.profiledir = other.profiledir
+
+	def run(self, profile=None):
+		if CHROME_PATH is None or CHROMEDRIVER_PATH is None:
+			raise RuntimeError('CHROME_PATH or CHROMEDRIVER_PATH unset')
+
+		self.enable_backend()
+
+		try:
+			self.start_browser(profile)
+			try:
+				self.run_iterations()
+			except Exception:
+				self.stop_browser()
+				raise
+			self.stop_browser(profile)
+		finally:
+			self.disable_backend()
 
 class CaseDriverWithHttpServer(CaseDriver):
 	def __init__(self, addr=None):
@@ -134,22 +265,33 @@ class CaseDriverWithHttpServer(CaseDriver):
 		self._serving_process.terminate()
 		self._serving_process.join()
 
+	def backend_key(self):
+		return ('http', relative_to_here(self.directory))
+
+	def share_backend(self, other):
+		self.port = other.port
+		self.url = other.url
+		return other
+
 class CaseDriverWprBase(CaseDriver):
-	def browser_args(self):
-		return super().browser_args() + [
+	def session_browser_args(self):
+		return super().session_browser_args() + [
 			'host-resolver-rules=MAP *:443 127.0.0.1:%d,EXCLUDE localhost' % self.https_port,
 			'ignore-certificate-errors-spki-list=PhrPvGIaAMmd29hj8BCZOq096yj7uMpRNHpn5PDxI6I=',
 			'proxy-server=http=https://127.0.0.1:%d' % self.https_to_http_port,
 			'trusted-spdy-proxy=127.0.0.1:%d' % self.https_to_http_port,
 		]
 
+	def archive_path(self):
+		return relative_to_here('web-page-records/' + str(self) + '.wprgo')
+
 	def try_enable_backend(self):
 		args = [
 			'wpr',
 			self.method,
 			'--https_port=%d' % self.https_port,
 			'--https_to_http_port=%d' % self.https_to_http_port,
-			relative_to_here('web-page-records/' + str(self) + '.wprgo')
+			self.archive_path()
 		]
 
 		self._wpr = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
@@ -186,6 +328,18 @@ class CaseDriverWprBase(CaseDriver):
 
 		raise Exception('Failed starting wpr (tried 10 times)')
 
+	def backend_key(self):
+		return ('wpr', self.method)
+
+	def share_backend(self, other):
+		# wpr serves only one archive, restart it with ours on the same ports,
+		# since the browser is already configured to use them
+		other.disable_backend()
+		self.https_to_http_port, self.https_port = other.https_to_http_port, other.https_port
+		if not self.try_enable_backend():
+			raise Exception('Failed restarting wpr on ports %d and %d' % (self.https_to_http_port, self.https_port))
+		return self
+
 	def disable_backend(self):
 		self._wpr.send_signal(signal.SIGINT)
 		self._wpr.wait(10)
@@ -199,3 +353,84 @@ class CaseDriverWprRecord(CaseDriverWprBase):
 
 class CaseDriverWprReplay(CaseDriverWprBase):
 	method = 'replay'
+
+# Groups cases which can share one browser session (same backend type and
+# browser arguments). Cases needing a clean browser get a group of their own.
+def batch_cases(cases):
+	groups = {}
+	res = []
+	for case in cases:
+		if case.needs_clean_browser:
+			res.append([case])
+			continue
+
+		key = case.session_key()
+		if key not in groups:
+			groups[key] = []
+			res.append(groups[key])
+		groups[key].append(case)
+
+	return res
+
+# Browser session of leader and backend shared by cases with the same session
+# key (see batch_cases). The backend is owned by the case which last started
+# it; owner is None if sharing it failed and no backend is running.
+class SharedSession:
+	def __init__(self, leader, profile=None):
+		self.leader = leader
+		self.profile = profile
+		self.owner = None
+
+	def __enter__(self):
+		self.leader.enable_backend()
+		self.owner = self.leader
+		try:
+			self.leader.start_browser(self.profile)
+		except Exception:
+			self.owner.disable_backend()
+			raise
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		try:
+			self.leader.stop_browser(self.profile if exc_type is None else None)
+		finally:
+			if self.owner is not None:
+				self.owner.disable_backend()
+
+	# Lets case use the shared browser and backend, in a fresh tab
+	def switch_to(self, case):
+		case.adopt_session(self.leader)
+		if case is not self.owner:
+			previous, self.owner = self.owner, None
+			self.owner = case.share_backend(previous)
+
+		self.leader.driver.open_in_new_tab('about:blank')
+		self.leader.driver.close_other_tabs()
+
+# Runs cases from one group in one browser session, each in a fresh tab, and
+# merges the profile once at the end. Returns list of (case, exception) pairs
+# for cases which failed or could not be run.
+def run_batch(cases, profile=None):
+	if CHROME_PATH is None or CHROMEDRIVER_PATH is None:
+		raise RuntimeError('CHROME_PATH or CHROMEDRIVER_PATH unset')
+
+	failed = []
+
+	with SharedSession(cases[0], profile) as session:
+		for i, case in enumerate(cases):
+			print('Running case %s' % case)
+			try:
+				if i > 0:
+					session.switch_to(case)
+				case.run_iterations()
+			except Exception as e:
+				print('Case %s failed: %s' % (case, repr(e)))
+				failed.append((case, e))
+
+				# without backend the remaining cases cannot run
+				if session.owner is None:
+					failed += [(c, e) for c in cases[i + 1:]]
+					break
+
+	return failed
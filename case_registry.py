@@ -0,0 +1,115 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#
+# Copyright 2022 Marek Behún <kabel@kernel.org>
+#
+# Declarative registry of all profile cases. Listing and selecting cases does
+# not import the case modules (and thus Selenium), only the selected cases are
+# loaded.
+
+import re
+from fnmatch import translate
+from importlib import import_module
+
+__all__ = ['CaseSpec', 'CASES', 'case_names', 'cases_in_module', 'select_cases']
+
+class CaseSpec:
+	def __init__(self, name, module, cls, *args, computes_score=False, **kwargs):
+		self.name = name
+		self.module = module
+		self.cls = cls
+		self.args = args
+		self.kwargs = kwargs
+		self.computes_score = computes_score
+
+	def __str__(self):
+		return self.name
+
+	def load(self):
+		cls = getattr(import_module(self.module), self.cls)
+		case = cls(*self.args, **self.kwargs)
+
+		if str(case) != self.name or case.computes_score != self.computes_score:
+			raise RuntimeError('case registry entry %s does not match case %s' % (self.name, case))
+
+		return case
+
+def _spec(module, cls, *args, suffix=None, **kwargs):
+	name = '%s.%s' % (module, cls)
+	if suffix is not None:
+		name += '.' + suffix
+	return CaseSpec(name, module, cls, *args, **kwargs)
+
+CASES = [
+	CaseSpec('speedometer2', 'speedometer2', 'speedometer2', computes_score=True),
+
+	_spec('webrtc_cases', 'GetUserMedia'),
+	_spec('webrtc_cases', 'DataChannel'),
+	_spec('webrtc_cases', 'CanvasCapturePeerConnection'),
+	_spec('webrtc_cases', 'VideoCodecConstraints', 'VP8', suffix='VP8'),
+	_spec('webrtc_cases', 'VideoCodecConstraints', 'VP9', suffix='VP9'),
+	_spec('webrtc_cases', 'VideoCodecConstraints', 'H264', suffix='H264'),
+	_spec('webrtc_cases', 'MultiplePeerConnections'),
+	_spec('webrtc_cases', 'PausePlayPeerConnections'),
+	_spec('webrtc_cases', 'InsertableStreamsAudioProcessing'),
+	_spec('webrtc_cases', 'InsertableStreamsVideoProcessing', 'camera', 'webgl', 'video', suffix='camera-webgl-video'),
+	_spec('webrtc_cases', 'InsertableStreamsVideoProcessing', 'video', 'webgl', 'video', suffix='video-webgl-video'),
+	_spec('webrtc_cases', 'InsertableStreamsVideoProcessing', 'pc', 'webgl', 'video', suffix='pc-webgl-video'),
+	_spec('webrtc_cases', 'InsertableStreamsVideoProcessing', 'camera', 'canvas2d', 'video', suffix='camera-canvas2d-video'),
+	_spec('webrtc_cases', 'InsertableStreamsVideoProcessing', 'camera', 'noop', 'video', suffix='camera-noop-video'),
+	_spec('webrtc_cases', 'InsertableStreamsVideoProcessing', 'camera', 'webgl', 'pc', suffix='camera-webgl-pc'),
+
+	_spec('desktop_cases', 'Browse', 'amazon', 'https://www.amazon.com.br/s/?k=telefone+celular', '.a-size-base-plus',
+	      suffix='amazon'),
+	_spec('desktop_cases', 'Browse', 'hackernews', 'https://news.ycombinator.com', '.athing .title > a', wait=3,
+	      suffix='hackernews'),
+	_spec('desktop_cases', 'Browse', 'reddit_news', 'https://www.reddit.com/r/news/top/?sort=top&t=week', 'article h3',
+	      wait=5, before_browsing='accept_cookies_reddit', suffix='reddit_news'),
+	_spec('desktop_cases', 'BrowseWithArrowRight', 'facebook_rihanna_photos',
+	      'https://www.facebook.com/photo/?fbid=10156761246686676&set=a.10152251658271676',
+	      'div[aria-label="Další fotka"]',
+	      browse_items=10, wait=1, go_back=False, before_browsing='accept_cookies_fb', suffix='facebook_rihanna_photos'),
+	_spec('desktop_cases', 'Scroll', '9gag', 'https://9gag.com', suffix='9gag'),
+	_spec('desktop_cases', 'Scroll', 'twitter_nasa', 'https://twitter.com/nasa', suffix='twitter_nasa'),
+	_spec('desktop_cases', 'Scroll', 'amazon_pixel', 'https://www.amazon.com/s?k=pixel', 5, suffix='amazon_pixel'),
+	_spec('desktop_cases', 'Scroll', 'google_docs',
+	      'https://docs.google.com/document/d/14sZMXhI1NljEDSFfxhgA4FNI2_rSImxx3tZ4YsNRUdU/preview?safe=true&Debug=true',
+	      elem='.kix-appview-editor', suffix='google_docs'),
+	_spec('desktop_cases', 'Tumblr'),
+
+	_spec('stress_cases', 'Aquarium'),
+	_spec('stress_cases', 'Kraken', computes_score=True),
+	_spec('stress_cases', 'PSPDFKit', computes_score=True),
+	_spec('stress_cases', 'BellardPCEmu'),
+	_spec('stress_cases', 'YouTubeVideo'),
+	_spec('stress_cases', 'SpreadSheet'),
+]
+
+_index = {spec.name: spec for spec in CASES}
+
+def case_names(benchmark=False):
+	return [spec.name for spec in CASES if not benchmark or spec.computes_score]
+
+def cases_in_module(module):
+	return [spec.load() for spec in CASES if spec.module == module]
+
+# Returns case specs matching glob-style patterns, in the order of patterns
+# (and in registry order for each pattern), without duplicates. Raises KeyError
+# with the pattern if some pattern does not match any case.
+def select_cases(patterns, benchmark=False):
+	names = case_names(benchmark)
+	selected = {}
+
+	for pattern in patterns:
+		if not re.search(r'[*?[]', pattern):
+			matches = [pattern] if pattern in _index and (not benchmark or _index[pattern].computes_score) else []
+		else:
+			regex = re.compile(translate(pattern))
+			matches = [name for name in names if regex.match(name)]
+
+		if not matches:
+			raise KeyError(pattern)
+
+		for name in matches:
+			selected.setdefault(name, _index[name])
+
+	return list(selected.values())
@@ -0,0 +1,222 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#
+# Copyright 2022 Marek Behún <kabel@kernel.org>
+#
+# Capturing of Chrome traces via the DevTools protocol. The trace is streamed
+# from the browser to a gzip compressed file in chunks, and summarized by
+# parsing that file incrementally, so it never needs to fit in memory.
+#
+# Selenium's execute_cdp_cmd() cannot receive DevTools events, which tracing
+# needs, so this talks to the browser's DevTools WebSocket directly.
+
+import base64, gzip, json, os, socket, struct
+from urllib.parse import urlparse
+from urllib.request import urlopen
+
+__all__ = ['DEFAULT_CATEGORIES', 'DevToolsConnection', 'Tracer', 'summarize_trace']
+
+DEFAULT_CATEGORIES = 'toplevel,devtools.timeline,disabled-by-default-devtools.timeline,v8,v8.execute,blink,loading'
+
+# top level task events, their durations sum up to thread busy time
+TOPLEVEL_TASKS = ('ThreadControllerImpl::RunTask', 'RunTask')
+MAIN_THREADS = ('CrBrowserMain', 'CrRendererMain')
+
+# Minimal WebSocket client for the DevTools protocol: text frames only, no
+# extensions
+class DevToolsConnection:
+	def __init__(self, url, timeout=60):
+		url = urlparse(url)
+		self._sock = socket.create_connection((url.hostname, url.port), timeout)
+		self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		self._file = self._sock.makefile('rb')
+		self._id = 0
+		self._events = []
+
+		key = base64.b64encode(os.urandom(16)).decode()
+		self._sock.sendall(('GET %s HTTP/1.1\r\nHost: %s\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+				    'Sec-WebSocket-Key: %s\r\nSec-WebSocket-Version: 13\r\n\r\n' %
+				    (url.path, url.netloc, key)).encode())
+
+		status = self._file.readline()
+		if b' 101 ' not in status:
+			raise Exception('DevTools WebSocket handshake failed: %s' % status.decode(errors='replace').strip())
+		while self._file.readline() not in (b'\r\n', b''):
+			pass
+
+	@classmethod
+	def for_driver(cls, driver):
+		address = driver.capabilities['goog:chromeOptions']['debuggerAddress']
+		with urlopen('http://%s/json/version' % address) as response:
+			return cls(json.load(response)['webSocketDebuggerUrl'])
+
+	def close(self):
+		self._file.close()
+		self._sock.close()
+
+	def _send_frame(self, opcode, payload):
+		header = bytes([0x80 | opcode])
+		if len(payload) < 126:
+			header += bytes([0x80 | len(payload)])
+		elif len(payload) < 1 << 16:
+			header += bytes([0x80 | 126]) + struct.pack('>H', len(payload))
+		else:
+			header += bytes([0x80 | 127]) + struct.pack('>Q', len(payload))
+
+		# client frames must be masked; our messages are small commands
+		mask = os.urandom(4)
+		masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+		self._sock.sendall(header + mask + masked)
+
+	def _read_exactly(self, length):
+		data = self._file.read(length)
+		if len(data) != length:
+			raise Exception('DevTools WebSocket closed')
+		return data
+
+	def _receive(self):
+		message = b''
+		while True:
+			first, second = self._read_exactly(2)
+			opcode = first & 0x0f
+			length = second & 0x7f
+			if length == 126:
+				length = struct.unpack('>H', self._read_exactly(2))[0]
+			elif length == 127:
+				length = struct.unpack('>Q', self._read_exactly(8))[0]
+			payload = self._read_exactly(length)
+
+			if opcode == 0x8:
+				raise Exception('DevTools WebSocket closed')
+			elif opcode == 0x9:
+				self._send_frame(0xa, payload)
+			elif opcode in (0x0, 0x1, 0x2):
+				message += payload
+				if first & 0x80:
+					return json.loads(message)
+
+	def send(self, method, **params):
+		self._id += 1
+		self._send_frame(0x1, json.dumps({'id': self._id, 'method': method, 'params': params}).encode())
+
+		while True:
+			message = self._receive()
+			if message.get('id') == self._id:
+				if 'error' in message:
+					raise Exception('%s failed: %s' % (method, message['error'].get('message')))
+				return message.get('result', {})
+			elif 'method' in message:
+				self._events.append(message)
+
+	def wait_for_event(self, method):
+		while True:
+			for i, event in enumerate(self._events):
+				if event.get('method') == method:
+					return self._events.pop(i)['params']
+			self._events.append(self._receive())
+
+# Captures a trace of the whole browser into a gzip compressed file
+class Tracer:
+	def __init__(self, driver, path, categories=DEFAULT_CATEGORIES, chunk_size=1 << 20):
+		self.path = path
+		self.chunk_size = chunk_size
+		self._connection = DevToolsConnection.for_driver(driver)
+		try:
+			self._connection.send('Tracing.start', transferMode='ReturnAsStream', streamCompression='gzip',
+					      traceConfig={'includedCategories': categories.split(',')})
+		except Exception:
+			self._connection.close()
+			raise
+
+	def stop(self):
+		try:
+			self._connection.send('Tracing.end')
+			complete = self._connection.wait_for_event('Tracing.tracingComplete')
+			stream = complete['stream']
+
+			with open(self.path, 'wb') as f:
+				while True:
+					chunk = self._connection.send('IO.read', handle=stream, size=self.chunk_size)
+					if chunk.get('base64Encoded'):
+						f.write(base64.b64decode(chunk['data']))
+					else:
+						f.write(chunk['data'].encode('latin-1'))
+					if chunk.get('eof'):
+						break
+
+			self._connection.send('IO.close', handle=stream)
+		finally:
+			self._connection.close()
+
+def _trace_events(path, chunk_size=1 << 20):
+	decoder = json.JSONDecoder()
+	with gzip.open(path, 'rt', encoding='utf-8') as f:
+		buf = f.read(chunk_size)
+
+		# the trace is either just [...] or {"traceEvents": [...], ...}, where
+		# the key may come after other keys
+		if buf.lstrip().startswith('['):
+			pos = buf.index('[')
+		else:
+			while True:
+				start = buf.find('"traceEvents"')
+				pos = buf.find('[', start) if start >= 0 else -1
+				if pos >= 0:
+					break
+				more = f.read(chunk_size)
+				if not more:
+					raise ValueError('no traceEvents in trace %s' % path)
+				buf += more
+		pos += 1
+
+		eof = False
+		while True:
+			while pos < len(buf) and buf[pos] in ' \t\r\n,':
+				pos += 1
+			if pos < len(buf) and buf[pos] == ']':
+				return
+
+			try:
+				event, end = decoder.raw_decode(buf, pos)
+			except ValueError:
+				if eof:
+					return
+				more = f.read(chunk_size)
+				eof = not more
+				buf = buf[pos:] + more
+				pos = 0
+				continue
+
+			yield event
+			pos = end
+
+# Returns busy time of browser and renderer main threads and time spent in the
+# most expensive event types on them, in milliseconds
+def summarize_trace(path, top=15):
+	thread_names = {}
+	durations = {}
+
+	for event in _trace_events(path):
+		thread = (event.get('pid'), event.get('tid'))
+		if event.get('ph') == 'M' and event.get('name') == 'thread_name':
+			thread_names[thread] = event.get('args', {}).get('name')
+		elif event.get('ph') == 'X' and 'dur' in event:
+			by_name = durations.setdefault(thread, {})
+			by_name[event['name']] = by_name.get(event['name'], 0) + event['dur']
+
+	res = {}
+	for thread, by_name in durations.items():
+		name = thread_names.get(thread)
+		if name not in MAIN_THREADS:
+			continue
+
+		summary = res.setdefault(name, {'threads': 0, 'busy_ms': 0.0, 'tasks_ms': {}})
+		summary['threads'] += 1
+		summary['busy_ms'] += sum(by_name.get(task, 0) for task in TOPLEVEL_TASKS) / 1000
+		for task, duration in by_name.items():
+			summary['tasks_ms'][task] = summary['tasks_ms'].get(task, 0) + duration / 1000
+
+	for summary in res.values():
+		tasks = sorted(summary['tasks_ms'].items(), key=lambda item: -item[1])[:top]
+		summary['tasks_ms'] = dict(tasks)
+
+	return res
@@ -6,19 +6,10 @@
 #
 # Copyright 2022 Marek Behún <kabel@kernel.org>
 
-import argparse, pathlib, sys, os.path
-from fnmatch import fnmatchcase
-import case_drivers
-
-def available_cases(benchmark=False):
-	import speedometer2, webrtc_cases, desktop_cases, stress_cases
-	res = []
-	for module in speedometer2, webrtc_cases, desktop_cases, stress_cases:
-		for case in module.all_cases():
-			if not benchmark or case.computes_score:
-				res.append(case)
-
-	return res
+import argparse, pathlib, sys, os.path, json
+import case_registry, wpr_archives, chrome_trace
+from profile_scratch import parse_size
+import bench_env
 
 def die(msg):
 	print('%s: error: %s' % (os.path.basename(sys.argv[0]), msg), file=sys.stderr)
@@ -33,20 +24,65 @@ parser = argparse.ArgumentParser(
 parser.add_argument('--chrome-executable', type=pathlib.Path, help='path to chrome executable')
 parser.add_argument('--chromedriver-executable', type=pathlib.Path, help='path to chromedriver executable')
 parser.add_argument('--list-cases', action='store_true', help='list available profile cases')
+parser.add_argument('--verify', action='store_true', help='verify Web Page Replay archives of selected cases against their checksums and print their size and number of requests')
+parser.add_argument('--record', action='store_true', help='record Web Page Replay archives of selected cases and update their checksums')
+parser.add_argument('--jobs', type=int, help='number of archives to record or verify in parallel. Default: 4 for --record, number of CPUs for --verify')
+parser.add_argument('--no-archive-check', action='store_true', help='do not verify Web Page Replay archives of selected cases before running them')
 parser.add_argument('--case', action='append', help='case to run, glob-style. May be used multiple times. Default: * (all)')
 parser.add_argument('--tries', type=int, help='Number of tries for each case in the case a run fails, or to average score when benchmarking. Default: 3')
 parser.add_argument('--profile-output', type=pathlib.Path, help='where to save LLVM profile data. Needs the llvm-profdata utility')
+parser.add_argument('--profile-scratch-dir', type=pathlib.Path, help='directory where to create the temporary directory for raw profile data, e.g. a tmpfs mount')
+parser.add_argument('--profile-scratch-limit', type=str, help='size of raw profile data (e.g. 2G) after which raw profiles of exited processes are merged early and removed')
+parser.add_argument('--profile-online-merge', type=int, metavar='N', help='let instrumented processes merge their profiles online into a pool of N files (LLVM %%Nm pattern)')
 parser.add_argument('--add-arg', action='append', type=str, help='additional command line argument for Chromium')
 parser.add_argument('--benchmark', action='store_true', help='run benchmark cases and print results')
+parser.add_argument('--benchmark-env', action='store_true', help='check CPU frequency scaling and load before benchmarking and print environment snapshot with each result')
+parser.add_argument('--max-load', type=float, help='refuse to benchmark if 1 minute load average is higher. Implies --benchmark-env')
+parser.add_argument('--harness-cpus', type=str, help='CPU list (e.g. 0-1) to pin the harness to when benchmarking')
+parser.add_argument('--browser-cpus', type=str, help='CPU list (e.g. 2-7) to pin the browser process tree to when benchmarking. Default: CPUs the harness was started with')
+parser.add_argument('--harness-nice', type=int, help='nice value of the harness when benchmarking')
+parser.add_argument('--browser-nice', type=int, help='nice value of the browser process tree when benchmarking. Default: nice value the harness was started with')
+parser.add_argument('--repeat', type=int, help='repeat navigation sequence of each case this many times in the same browser session, to profile warm paths. Not available with --benchmark. Default: 1')
+parser.add_argument('--clear-cache-between-repeats', action='store_true', help='clear browser HTTP cache between repeats of --repeat')
+parser.add_argument('--soak', type=str, metavar='DURATION', help='cycle through selected cases in one browser session for DURATION (e.g. 90m, 4h) and report memory growth and latency drift. Not available with --benchmark')
+parser.add_argument('--soak-output', type=pathlib.Path, help='where to save all --soak samples as JSON')
+parser.add_argument('--trace-dir', type=pathlib.Path, help='capture Chrome trace of each case run into this directory and print its summary')
+parser.add_argument('--trace-categories', type=str, help='comma separated trace categories for --trace-dir. Default: %s' % chrome_trace.DEFAULT_CATEGORIES)
+parser.add_argument('--batch', action='store_true', help='run compatible cases in one browser session, in separate tabs. Not available with --benchmark')
 
 if __name__ == '__main__':
 	args = parser.parse_args()
 
 	if args.list_cases:
-		for case in available_cases(args.benchmark):
-			print(case)
+		for name in case_registry.case_names(args.benchmark):
+			print(name)
 		exit(0)
 
+	if not args.case:
+		args.case = ['*']
+
+	try:
+		specs_to_run = case_registry.select_cases(args.case, args.benchmark)
+	except KeyError as e:
+		die('no cases found matching `%s\'' % e.args[0])
+
+	if args.jobs is not None and args.jobs < 1:
+		die('invalid value for --jobs option: %s' % args.jobs)
+
+	if args.verify:
+		archives = [spec.name for spec in specs_to_run if wpr_archives.has_checksum(spec.name)]
+		failed = 0
+		for name, info, error in wpr_archives.verify_archives(archives, args.jobs, requests=True):
+			if error:
+				print('FAILED %s: %s' % (name, error))
+				failed += 1
+			else:
+				print('OK %s: %.1f MiB, %d requests' % (name, info['size'] / (1 << 20), info['requests']))
+		exit(1 if failed else 0)
+
+	# imports Selenium, so do not import it for --list-cases
+	import case_drivers
+
 	if args.chrome_executable is None or args.chromedriver_executable is None:
 		die('--chrome-executable and --chromedriver-executable are required')
 
@@ -65,6 +101,24 @@ if __name__ == '__main__':
 	else:
 		profile = None
 
+	if args.profile_scratch_dir is not None:
+		if not args.profile_scratch_dir.is_dir():
+			die('invalid profile scratch directory: %s' % args.profile_scratch_dir)
+		case_drivers.PROFILE_SCRATCH_DIR = str(args.profile_scratch_dir.absolute())
+
+	if args.profile_scratch_limit is not None:
+		try:
+			case_drivers.PROFILE_SCRATCH_LIMIT = parse_size(args.profile_scratch_limit)
+		except ValueError:
+			die('invalid value for --profile-scratch-limit option: %s' % args.profile_scratch_limit)
+
+	if args.profile_online_merge is not None:
+		if args.profile_online_merge < 1 or args.profile_online_merge > 9:
+			die('invalid value for --profile-online-merge option: %s' % args.profile_online_merge)
+		if args.profile_scratch_limit is not None:
+			die('--profile-online-merge cannot be used with --profile-scratch-limit')
+		case_drivers.PROFILE_ONLINE_MERGE = args.profile_online_merge
+
 	if args.tries is not None:
 		if args.tries < 1:
 			die('invalid value for --tries option: %s' % args.tries)
@@ -72,6 +126,103 @@ if __name__ == '__main__':
 	else:
 		tries = 3
 
+	env_options = [args.harness_cpus, args.browser_cpus, args.harness_nice, args.browser_nice, args.max_load]
+	if args.benchmark_env or any(option is not None for option in env_options):
+		if not args.benchmark:
+			die('--benchmark-env and related options can only be used with --benchmark')
+
+		allowed_cpus = os.sched_getaffinity(0)
+		harness_cpus = None
+		for option, value in ('--harness-cpus', args.harness_cpus), ('--browser-cpus', args.browser_cpus):
+			if value is None:
+				continue
+			try:
+				cpus = bench_env.parse_cpu_list(value)
+			except ValueError:
+				die('invalid value for %s option: %s' % (option, value))
+			if not cpus or not cpus <= allowed_cpus:
+				die('invalid value for %s option: %s (allowed CPUs: %s)' %
+				    (option, value, ','.join(str(cpu) for cpu in sorted(allowed_cpus))))
+			if option == '--harness-cpus':
+				harness_cpus = cpus
+			else:
+				case_drivers.BROWSER_CPUS = cpus
+
+		# chromedriver, the browser and wpr are started by the harness and
+		# inherit its CPU set and nice value, so unless given explicitly, the
+		# browser process tree gets back the original ones
+		if harness_cpus is not None and case_drivers.BROWSER_CPUS is None:
+			case_drivers.BROWSER_CPUS = allowed_cpus
+
+		# lowering the nice value of a process needs root privileges
+		current_nice = os.getpriority(os.PRIO_PROCESS, 0)
+		harness_nice = args.harness_nice if args.harness_nice is not None else current_nice
+		for option, value, inherited in (('--harness-nice', args.harness_nice, current_nice),
+						 ('--browser-nice', args.browser_nice, harness_nice)):
+			if value is None:
+				continue
+			if value < -20 or value > 19:
+				die('invalid value for %s option: %s' % (option, value))
+			if value < inherited and os.geteuid() != 0:
+				die('%s %d needs root privileges (nice value would be %d otherwise)' % (option, value, inherited))
+
+		browser_nice = args.browser_nice
+		if browser_nice is None and args.harness_nice is not None:
+			browser_nice = current_nice
+			if browser_nice < harness_nice and os.geteuid() != 0:
+				die('--harness-nice %d without --browser-nice needs root privileges to restore nice value %d of '
+				    'the browser' % (harness_nice, browser_nice))
+
+		try:
+			bench_env.pin_and_prioritize(os.getpid(), harness_cpus, args.harness_nice)
+		except (OSError, ValueError) as e:
+			die('cannot set harness CPU affinity or priority: %s' % e)
+		case_drivers.BROWSER_NICE = browser_nice
+
+		env = bench_env.snapshot()
+		max_load = args.max_load if args.max_load is not None else bench_env.DEFAULT_MAX_LOAD
+		for warning in bench_env.warnings(env, max_load):
+			print('warning: %s' % warning, file=sys.stderr)
+		if args.max_load is not None and env['loadavg'][0] > args.max_load:
+			die('load average %.2f is higher than %.2f, refusing to benchmark' % (env['loadavg'][0], args.max_load))
+
+		case_drivers.RECORD_ENVIRONMENT = True
+
+	if args.trace_dir is not None:
+		if not args.trace_dir.is_dir():
+			die('invalid trace directory: %s' % args.trace_dir)
+		case_drivers.TRACE_DIR = str(args.trace_dir.absolute())
+		if args.trace_categories:
+			case_drivers.TRACE_CATEGORIES = args.trace_categories
+	elif args.trace_categories is not None:
+		die('--trace-categories can only be used with --trace-dir')
+
+	if args.repeat is not None:
+		if args.repeat < 1:
+			die('invalid value for --repeat option: %s' % args.repeat)
+		if args.benchmark:
+			die('--repeat cannot be used with --benchmark')
+		case_drivers.REPEATS = args.repeat
+
+	if args.clear_cache_between_repeats:
+		if args.repeat is None or args.repeat < 2:
+			die('--clear-cache-between-repeats can only be used with --repeat greater than 1')
+		case_drivers.CLEAR_CACHE_BETWEEN_REPEATS = True
+
+	if args.batch and args.benchmark:
+		die('--batch cannot be used with --benchmark')
+
+	if args.soak is not None:
+		import soak
+		try:
+			soak_duration = soak.parse_duration(args.soak)
+		except ValueError:
+			die('invalid value for --soak option: %s' % args.soak)
+		if args.benchmark or args.batch:
+			die('--soak cannot be used with --benchmark or --batch')
+	elif args.soak_output is not None:
+		die('--soak-output can only be used with --soak')
+
 	if not args.add_arg:
 		args.add_arg = []
 
@@ -80,41 +231,106 @@ if __name__ == '__main__':
 			arg = arg[2:]
 		case_drivers.ADDITIONAL_ARGUMENTS.append(arg)
 
-	if not args.case:
-		args.case = ['*']
+	if args.record:
+		import multiprocessing
+		from concurrent.futures import ProcessPoolExecutor, as_completed
+
+		specs_to_record = [spec for spec in specs_to_run
+				   if isinstance(spec.load(), case_drivers.CaseDriverWprReplay)]
+		if not specs_to_record:
+			die('no Web Page Replay cases selected for recording')
+
+		# each case runs in its own process, since LLVM_PROFILE_FILE is set in
+		# the environment of the process
+		with ProcessPoolExecutor(args.jobs or 4, mp_context=multiprocessing.get_context('fork')) as executor:
+			futures = [executor.submit(wpr_archives.record_case, spec.name) for spec in specs_to_record]
+			failed = 0
+			for future in as_completed(futures):
+				name, error = future.result()
+				if error:
+					print('Recording %s failed: %s' % (name, error))
+					failed += 1
+				else:
+					print('Recorded %s' % name)
+		exit(1 if failed else 0)
+
+	if not args.no_archive_check:
+		archives = [spec.name for spec in specs_to_run if wpr_archives.has_checksum(spec.name)]
+		failed = 0
+		for name, info, error in wpr_archives.verify_archives(archives, args.jobs):
+			if error:
+				print('Archive check of %s failed: %s' % (name, error), file=sys.stderr)
+				failed += 1
+		if failed:
+			die('%d archive(s) failed the check, use --no-archive-check to run anyway' % failed)
+
+	cases_to_run = [spec.load() for spec in specs_to_run]
 
-	cases_to_run_names = []
-	cases_to_run = []
-	for arg in args.case:
-		i = 0
-		for case in available_cases(args.benchmark):
-			case_name = str(case)
-			if fnmatchcase(case_name, arg) and case_name not in cases_to_run_names:
-				cases_to_run_names.append(case_name)
-				cases_to_run.append(case)
-				i += 1
-		if i == 0:
-			die('no cases found matching `%s\'' % arg)
+	def run_case(case, tries):
+		print('Running case %s' % case)
+		for i in range(1, tries + 1):
+			try:
+				case.run(profile)
+				print('TIMING[%s] %s' % (case, case.timings_summary()))
+				break
+			except Exception as e:
+				print('Run %d/%d failed: %s' % (i, tries, repr(e)))
+				if i < tries:
+					print('Running case %s again' % case)
+
+	if args.soak is not None:
+		if len(case_drivers.batch_cases(cases_to_run)) != 1:
+			die('cases for --soak must be able to share one browser session (same backend type and browser arguments)')
+
+		samples = soak.run_soak(cases_to_run, soak_duration, profile)
+		for name, result in soak.soak_report(samples).items():
+			print('SOAK_RESULT[%s] = %s' % (name, json.dumps(result)))
+
+		if args.soak_output:
+			with open(args.soak_output, 'w') as f:
+				json.dump(samples, f, indent=1)
+		exit(0)
+
+	if args.batch:
+		for batch in case_drivers.batch_cases(cases_to_run):
+			if len(batch) == 1:
+				run_case(batch[0], tries)
+				continue
+
+			print('Running batch of %d cases in one browser session' % len(batch))
+			try:
+				failed = case_drivers.run_batch(batch, profile)
+			except Exception as e:
+				print('Batch failed: %s' % repr(e))
+				failed = [(case, e) for case in batch]
+
+			failed_cases = [case for case, e in failed]
+			for case in batch:
+				if case not in failed_cases:
+					print('TIMING[%s] %s' % (case, case.timings_summary()))
+
+			# cases failed in the batch get the remaining tries in a clean browser
+			if tries > 1:
+				for case, e in failed:
+					run_case(case, tries - 1)
+		exit(0)
 
 	for case in cases_to_run:
 		if args.benchmark:
 			print('Benchmarking %s' % case)
 
 			score_sum = 0.0
+			environments = []
 			for i in range(tries):
 				case.run(profile)
 				score_sum += case.score
 				del case.score
+				if case_drivers.RECORD_ENVIRONMENT:
+					environments.append(case.environment)
 			average_score = score_sum / tries
 
 			print('BENCHMARK_RESULT[%s] = %f' % (case, average_score))
+			if environments:
+				print('BENCHMARK_ENV[%s] = %s' % (case, json.dumps(environments)))
 		else:
-			print('Running case %s' % case)
-			for i in range(1, tries + 1):
-				try:
-					case.run(profile)
-					break
-				except Exception as e:
-					print('Run %d/%d failed: %s' % (i, tries, repr(e)))
-					if i < tries:
-						print('Running case %s again' % case)
+			run_case(case, tries)
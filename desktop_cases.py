@@ -10,6 +10,7 @@ from selenium.common.exceptions import ElementNotInteractableException, ElementC
 from time import sleep
 from case_drivers import CaseDriverWprReplay
 from webdriver import repeat_on_error
+import case_registry
 
 class Scroll(CaseDriverWprReplay):
 	def __init__(self, name, url, time=10, elem=None, by=30, period=50):
@@ -41,9 +42,6 @@ class Browse(CaseDriverWprReplay):
 	def __str__(self):
 		return super().__str__() + '.%s' % self.name
 
-	def before_browsing(self):
-		pass
-
 	@staticmethod
 	def try_click(elem, tries=5):
 		for i in range(tries):
@@ -66,8 +64,9 @@ class Browse(CaseDriverWprReplay):
 	def case_run(self):
 		self.driver.get(self.url)
 
+		# before_browsing is the name of a static method of Browse
 		if self.before_browsing:
-			self.before_browsing(self)
+			getattr(Browse, self.before_browsing)(self)
 
 		for i in range(self.browse_items):
 			if self.goto_item(i):
@@ -108,19 +107,4 @@ class Tumblr(CaseDriverWprReplay):
 		sleep(10)
 
 def all_cases():
-	return [
-		Browse('amazon', 'https://www.amazon.com.br/s/?k=telefone+celular', '.a-size-base-plus'),
-		Browse('hackernews', 'https://news.ycombinator.com', '.athing .title > a', wait=3),
-		Browse('reddit_news', 'https://www.reddit.com/r/news/top/?sort=top&t=week', 'article h3',
-			wait=5, before_browsing=Browse.accept_cookies_reddit),
-		BrowseWithArrowRight('facebook_rihanna_photos',
-				     'https://www.facebook.com/photo/?fbid=10156761246686676&set=a.10152251658271676',
-				     'div[aria-label="Další fotka"]',
-				      browse_items=10, wait=1, go_back=False, before_browsing=Browse.accept_cookies_fb),
-		Scroll('9gag', 'https://9gag.com'),
-		Scroll('twitter_nasa', 'https://twitter.com/nasa'),
-		Scroll('amazon_pixel', 'https://www.amazon.com/s?k=pixel', 5),
-		Scroll('google_docs', 'https://docs.google.com/document/d/14sZMXhI1NljEDSFfxhgA4FNI2_rSImxx3tZ4YsNRUdU/preview?safe=true&Debug=true',
-			elem='.kix-appview-editor'),
-		Tumblr(),
-	]
+	return case_registry.cases_in_module(__name__)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# SPDX-License-Identifier: BSD-3-Clause
+#
+# Offline benchmark of the profiling harness itself. Uses the stub
+# chromedriver, wpr and llvm-profdata from bench-stubs/ and synthetic raw
+# profiles, so neither Chromium nor Web Page Replay archives are needed.
+#
+# Copyright 2022 Marek Behún <kabel@kernel.org>
+
+import argparse, json, os, pathlib, platform, statistics, subprocess, sys
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from urllib.request import urlopen
+
+module_path = pathlib.Path(__file__)
+stubs_path = module_path.parent / 'bench-stubs'
+
+# the harness runs wpr and llvm-profdata from PATH
+os.environ['PATH'] = '%s:%s' % (stubs_path, os.environ.get('PATH', ''))
+
+import case_drivers
+from case_drivers import CaseDriverWithHttpServer, CaseDriverWprReplay
+from profile_scratch import merge_profiles, ScratchMonitor
+
+class NullHttpCase(CaseDriverWithHttpServer):
+	directory = 'speedometer'
+
+	def case_run(self):
+		self.driver.get(self.url)
+
+class NullWprCase(CaseDriverWprReplay):
+	def case_run(self):
+		self.driver.get('https://example.com')
+
+def measure(func, iterations, setup=None, teardown=None):
+	times = []
+	for i in range(iterations):
+		if setup:
+			setup()
+		start = perf_counter()
+		func()
+		times.append(perf_counter() - start)
+		if teardown:
+			teardown()
+	return times
+
+def summary(times, unit='s', per=1):
+	values = [t / per for t in times]
+	return {
+		'unit': unit,
+		'mean': statistics.mean(values),
+		'median': statistics.median(values),
+		'stdev': statistics.stdev(values) if len(values) > 1 else 0.0,
+		'min': min(values),
+		'n': len(values),
+	}
+
+def bench_backends(results, iterations):
+	for name, case in ('http', NullHttpCase()), ('wpr', NullWprCase()):
+		results['backend.%s.start' % name] = summary(measure(case.enable_backend, iterations,
+								     teardown=case.disable_backend))
+		results['backend.%s.stop' % name] = summary(measure(case.disable_backend, iterations,
+								    setup=case.enable_backend))
+
+def bench_driver(results, iterations):
+	case = NullHttpCase()
+	case.enable_backend()
+	try:
+		results['driver.start'] = summary(measure(case.start_browser, max(iterations // 10, 3),
+							  teardown=case.stop_browser))
+
+		case.start_browser()
+		try:
+			results['driver.get'] = summary(measure(lambda: case.driver.get(case.url), iterations))
+			results['driver.execute_script'] = summary(measure(lambda: case.driver.execute_script('return 1;'),
+									   iterations))
+			results['driver.wait_for_javascript_condition'] = \
+				summary(measure(lambda: case.driver.wait_for_javascript_condition('true'), iterations))
+		finally:
+			case.stop_browser()
+	finally:
+		case.disable_backend()
+
+def bench_http_server(results, requests, concurrency):
+	case = NullHttpCase()
+	case.enable_backend()
+	try:
+		url = case.url + '/index.html'
+		size = len(urlopen(url).read())
+
+		def fetch(i):
+			with urlopen(url) as response:
+				response.read()
+
+		with ThreadPoolExecutor(concurrency) as executor:
+			start = perf_counter()
+			list(executor.map(fetch, range(requests)))
+			elapsed = perf_counter() - start
+	finally:
+		case.disable_backend()
+
+	results['http.request'] = summary([elapsed], per=requests)
+	results['http.throughput'] = {'unit': 'MB/s', 'mean': requests * size / elapsed / 1e6, 'n': requests}
+
+def bench_merge(results, files, size, iterations):
+	with TemporaryDirectory() as directory:
+		inputs = []
+		for i in range(files):
+			path = '%s/bench-%d.profraw' % (directory, 1000000 + i)
+			with open(path, 'wb') as f:
+				f.write(os.urandom(size))
+			inputs.append(path)
+
+		output = '%s/merged.profdata' % directory
+
+		def remove_output():
+			if os.path.exists(output):
+				os.unlink(output)
+
+		times = measure(lambda: merge_profiles(inputs, output, '%s/temp.profdata' % directory), iterations,
+				teardown=remove_output)
+		results['merge'] = summary(times)
+		results['merge.throughput'] = {'unit': 'MB/s', 'mean': files * size * len(times) / sum(times) / 1e6,
+					       'n': len(times)}
+
+		# limit is never crossed, this measures the periodic scan only
+		monitor = ScratchMonitor(directory, 1 << 62, merge=False)
+		results['scratch.check'] = summary(measure(monitor.check, iterations))
+
+def bench_cases(results, iterations, profile_size):
+	os.environ['STUB_PROFRAW_SIZE'] = str(profile_size)
+
+	with TemporaryDirectory() as directory:
+		profile = '%s/profile.profdata' % directory
+
+		def remove_profile():
+			if os.path.exists(profile):
+				os.unlink(profile)
+
+		for name, cls in ('http', NullHttpCase), ('wpr', NullWprCase):
+			case = cls()
+			results['case.%s.run' % name] = summary(measure(lambda: case.run(profile), iterations,
+									teardown=remove_profile))
+
+			cases = [cls() for i in range(iterations)]
+			times = measure(lambda: case_drivers.run_batch(cases, profile), 1, teardown=remove_profile)
+			results['case.%s.batch' % name] = summary(times, per=iterations)
+
+def revision():
+	try:
+		return subprocess.run(['git', 'describe', '--always', '--dirty', '--tags'], cwd=module_path.parent,
+				      capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def compare(results, baseline):
+	print('%-40s %14s %14s %8s' % ('benchmark', 'baseline', 'current', 'change'))
+	for name, result in results.items():
+		if name not in baseline:
+			continue
+		old = baseline[name]['mean']
+		new = result['mean']
+		change = (new - old) / old * 100 if old else 0.0
+		print('%-40s %14.6g %14.6g %+7.1f%%' % (name, old, new, change))
+
+parser = argparse.ArgumentParser(
+	description='Offline benchmark of the chromium-profiler harness, using stub browser and backends',
+	epilog='Written in 2022 by Marek Behún <kabel@kernel.org>, license: BSD-3-Clause'
+)
+parser.add_argument('--iterations', type=int, default=20, help='iterations of each measurement. Default: 20')
+parser.add_argument('--http-requests', type=int, default=2000, help='number of requests for HTTP server throughput. Default: 2000')
+parser.add_argument('--http-concurrency', type=int, default=8, help='concurrent clients for HTTP server throughput. Default: 8')
+parser.add_argument('--profile-files', type=int, default=20, help='number of synthetic raw profiles to merge. Default: 20')
+parser.add_argument('--profile-size', type=int, default=4 << 20, help='size of synthetic raw profiles in bytes. Default: 4 MiB')
+parser.add_argument('--output', type=pathlib.Path, help='write results as JSON to this file')
+parser.add_argument('--compare', type=pathlib.Path, help='compare with results from a previous --output')
+
+if __name__ == '__main__':
+	args = parser.parse_args()
+
+	case_drivers.CHROME_PATH = str(stubs_path / 'chromedriver')
+	case_drivers.CHROMEDRIVER_PATH = str(stubs_path / 'chromedriver')
+
+	results = {}
+	bench_backends(results, args.iterations)
+	bench_driver(results, args.iterations)
+	bench_http_server(results, args.http_requests, args.http_concurrency)
+	bench_merge(results, args.profile_files, args.profile_size, args.iterations)
+	bench_cases(results, args.iterations, args.profile_size)
+
+	for name, result in results.items():
+		print('%-40s %14.6g %s' % (name, result['mean'], result['unit']))
+
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump({
+				'revision': revision(),
+				'python': platform.python_version(),
+				'machine': platform.machine(),
+				'results': results,
+			}, f, indent=1)
+
+	if args.compare:
+		with open(args.compare) as f:
+			print()
+			compare(results, json.load(f)['results'])
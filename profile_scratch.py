@@ -0,0 +1,144 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#
+# Copyright 2022 Marek Behún <kabel@kernel.org>
+#
+# Handling of the scratch directory where instrumented Chromium writes its raw
+# LLVM profile data: merging, and keeping its size bounded while a browser is
+# running.
+
+import os, subprocess, threading
+from glob import glob
+from shutil import copyfile
+
+__all__ = ['merge_profiles', 'raw_profiles_usage', 'scratch_usage', 'ScratchMonitor', 'parse_size']
+
+EARLY_MERGED = 'early-merged.profdata'
+
+# Merges inputs (and output, if it already exists) into output with
+# llvm-profdata, via temporary file temp_output
+def merge_profiles(inputs, output, temp_output):
+	args = ['llvm-profdata', 'merge', '-output', temp_output]
+	args += inputs
+	if os.path.isfile(output):
+		args.append(output)
+
+	result = subprocess.run(args)
+	if result.returncode != 0:
+		raise Exception('Profile merging failed [return code %d]' % result.returncode)
+
+	if os.path.exists(output):
+		os.unlink(output)
+	try:
+		os.rename(temp_output, output)
+	except OSError:
+		copyfile(temp_output, output)
+		os.unlink(temp_output)
+
+def raw_profiles(directory):
+	return glob('%s/*.profraw' % directory)
+
+# Returns (number of files, total size in bytes) of raw profiles in directory
+def raw_profiles_usage(directory):
+	paths = raw_profiles(directory)
+	return len(paths), sum(os.path.getsize(path) for path in paths)
+
+# Returns (number of files, total size in bytes) of all files in directory
+def scratch_usage(directory):
+	files = 0
+	size = 0
+	for entry in os.scandir(directory):
+		if entry.is_file():
+			files += 1
+			size += entry.stat().st_size
+	return files, size
+
+def parse_size(value):
+	units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+	value = value.strip().upper()
+	if value.endswith('B'):
+		value = value[:-1]
+	if value and value[-1] in units:
+		return int(float(value[:-1]) * units[value[-1]])
+	return int(value)
+
+# Watches the scratch directory and, once its size crosses limit, merges the
+# raw profiles of already exited processes into EARLY_MERGED (or just removes
+# them if profile output is not wanted) and deletes them.
+#
+# The runtime creates the raw profile when a process starts and writes it when
+# the process exits. PIDs in file names cannot tell whether the process still
+# runs, since sandboxed processes live in their own PID namespace, so a raw
+# profile is considered finished when it is non-empty and its size and mtime
+# did not change over the last two periods.
+class ScratchMonitor:
+	def __init__(self, directory, limit, merge=True, period=1):
+		self.directory = directory
+		self.limit = limit
+		self.merge = merge
+		self.period = period
+
+		self.early_merges = 0
+		self.files_written = 0
+		self.bytes_written = 0
+		self.peak_usage = 0
+
+		# path -> ((size, mtime), number of checks it stayed the same)
+		self._stamps = {}
+
+		self._stop = threading.Event()
+		self._thread = threading.Thread(target=self._monitor, daemon=True)
+
+	def start(self):
+		self._thread.start()
+
+	def stop(self):
+		self._stop.set()
+		self._thread.join()
+
+	def _monitor(self):
+		while not self._stop.wait(self.period):
+			try:
+				self.check()
+			except Exception as e:
+				print('Early profile merging failed: %s' % repr(e))
+
+	def _finished(self, path):
+		try:
+			st = os.stat(path)
+		except FileNotFoundError:
+			return False
+
+		stamp = (st.st_size, st.st_mtime_ns)
+		previous, stable = self._stamps.get(path, (None, 0))
+		stable = stable + 1 if stamp == previous else 0
+		self._stamps[path] = (stamp, stable)
+
+		return st.st_size > 0 and stable >= 2
+
+	def check(self):
+		files, usage = scratch_usage(self.directory)
+		self.peak_usage = max(self.peak_usage, usage)
+
+		# track all raw profiles, so that stability is known once the limit
+		# is crossed
+		paths = raw_profiles(self.directory)
+		finished = [path for path in paths if self._finished(path)]
+		for path in set(self._stamps) - set(paths):
+			del self._stamps[path]
+
+		if usage < self.limit or not finished:
+			return
+
+		size = sum(os.path.getsize(path) for path in finished)
+
+		if self.merge:
+			merge_profiles(finished, os.path.join(self.directory, EARLY_MERGED),
+				       os.path.join(self.directory, 'temp-early-merged.profdata'))
+
+		for path in finished:
+			os.unlink(path)
+			del self._stamps[path]
+
+		self.early_merges += 1
+		self.files_written += len(finished)
+		self.bytes_written += size
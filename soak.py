@@ -0,0 +1,142 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#
+# Copyright 2022 Marek Behún <kabel@kernel.org>
+#
+# Endurance (soak) mode: cycles through a mix of cases in one long-lived
+# browser session and records memory of the browser and renderer processes and
+# latency of each iteration, to find slow leaks and degradation. Linux only.
+
+import os
+from time import monotonic, perf_counter
+import case_drivers
+from bench_env import process_tree
+
+__all__ = ['parse_duration', 'memory_usage', 'slope', 'run_soak', 'soak_report']
+
+def parse_duration(value):
+	units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+	value = value.strip().lower()
+	if value and value[-1] in units:
+		return float(value[:-1]) * units[value[-1]]
+	return float(value)
+
+# Returns (bytes, metric) tuple of memory usage of process pid. PSS does not
+# count shared memory multiple times, fall back to RSS on older kernels and for
+# sandboxed (non-dumpable) processes, whose smaps_rollup cannot be read.
+def _memory(pid):
+	try:
+		with open('/proc/%d/smaps_rollup' % pid) as f:
+			for line in f:
+				if line.startswith('Pss:'):
+					return int(line.split()[1]) * 1024, 'pss'
+	except OSError:
+		pass
+
+	with open('/proc/%d/statm' % pid) as f:
+		return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE'), 'rss'
+
+def _process_type(pid):
+	with open('/proc/%d/cmdline' % pid, 'rb') as f:
+		for arg in f.read().split(b'\0'):
+			if arg.startswith(b'--type='):
+				return arg[7:].decode()
+	return 'browser'
+
+# Returns dictionary of memory usage in bytes of browser, renderer and other
+# processes in the process tree of chromedriver with pid, and the metric used
+# for it: pss, rss, or pss+rss if it differed between processes
+def memory_usage(pid):
+	res = {'browser': 0, 'renderer': 0, 'other': 0}
+	metrics = set()
+	for process in process_tree(pid):
+		if process == pid:
+			continue
+		try:
+			kind = _process_type(process)
+			memory, metric = _memory(process)
+		except OSError:
+			continue
+		res[kind if kind in res else 'other'] += memory
+		metrics.add(metric)
+	res['metric'] = '+'.join(sorted(metrics)) or None
+	return res
+
+# least squares slope of ys against xs
+def slope(xs, ys):
+	n = len(xs)
+	if n < 2:
+		return 0.0
+	mean_x = sum(xs) / n
+	mean_y = sum(ys) / n
+	var = sum((x - mean_x) ** 2 for x in xs)
+	if var == 0:
+		return 0.0
+	return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var
+
+def _soak_loop(session, cases, duration, samples):
+	pid = session.leader.driver.service.process.pid
+	start = monotonic()
+	iteration = 0
+	while monotonic() - start < duration:
+		print('Soak iteration %d (%.0f s elapsed)' % (iteration, monotonic() - start))
+		for case in cases:
+			failed = False
+			case_start = perf_counter()
+			try:
+				if len(cases) > 1:
+					session.switch_to(case)
+					case_start = perf_counter()
+				case.case_run()
+			except Exception as e:
+				print('Case %s failed: %s' % (case, repr(e)))
+				if session.owner is None:
+					print('Backend lost, stopping soak run early')
+					return
+				failed = True
+			latency = perf_counter() - case_start
+
+			sample = {'iteration': iteration, 'time': monotonic() - start, 'latency': latency,
+				  'failed': failed}
+			sample.update(memory_usage(pid))
+			samples[str(case)].append(sample)
+		iteration += 1
+
+# Runs cases, which must be able to share a browser session (see
+# case_drivers.batch_cases), over and over for duration seconds. Returns
+# dictionary mapping case names to lists of samples. The run stops early on
+# Ctrl-C or if the backend is lost, and samples collected until then are
+# returned also if closing the session fails.
+def run_soak(cases, duration, profile=None):
+	samples = {str(case): [] for case in cases}
+
+	try:
+		with case_drivers.SharedSession(cases[0], profile) as session:
+			try:
+				_soak_loop(session, cases, duration, samples)
+			except KeyboardInterrupt:
+				print('Soak run interrupted, stopping early')
+	except Exception as e:
+		if not any(samples.values()):
+			raise
+		print('Soak session failed: %s' % repr(e))
+
+	return samples
+
+# Returns per case summary of samples from run_soak: number of iterations and
+# failures, memory growth in bytes per iteration and latency drift in seconds
+# per iteration
+def soak_report(samples):
+	res = {}
+	for name, case_samples in samples.items():
+		ok = [sample for sample in case_samples if not sample['failed']]
+		iterations = [sample['iteration'] for sample in ok]
+		res[name] = {
+			'iterations': len(case_samples),
+			'failures': len(case_samples) - len(ok),
+			'browser_bytes_per_iteration': slope(iterations, [sample['browser'] for sample in ok]),
+			'renderer_bytes_per_iteration': slope(iterations, [sample['renderer'] for sample in ok]),
+			'latency_first': ok[0]['latency'] if ok else None,
+			'latency_last': ok[-1]['latency'] if ok else None,
+			'latency_drift_per_iteration': slope(iterations, [sample['latency'] for sample in ok]),
+		}
+	return res
@@ -16,11 +16,13 @@
 
 from time import sleep
 from case_drivers import CaseDriverWithHttpServer
+import case_registry
 
 class speedometer2(CaseDriverWithHttpServer):
 	directory='speedometer'
 	timeout = 100
 	computes_score = True
+	needs_clean_browser = True
 
 	def __str__(self):
 		return 'speedometer2'
@@ -45,4 +47,4 @@ class speedometer2(CaseDriverWithHttpServer):
 		self.score = float(result_number.text)
 
 def all_cases():
-	return [speedometer2()]
+	return case_registry.cases_in_module(__name__)
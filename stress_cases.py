@@ -7,8 +7,10 @@
 
 from time import sleep
 from case_drivers import CaseDriverWprReplay
+from webdriver import region_hash
 import urllib.parse
 import json
+import case_registry
 
 class Aquarium(CaseDriverWprReplay):
 	def case_run(self):
@@ -19,6 +21,7 @@ class Kraken(CaseDriverWprReplay):
 	url = 'https://mozilla.github.io/krakenbenchmark.mozilla.org/kraken-1.1/driver.html'
 	result_url_prefix = 'https://mozilla.github.io/krakenbenchmark.mozilla.org/kraken-1.1/results.html?'
 	computes_score = True
+	needs_clean_browser = True
 
 	def case_run(self):
 		self.driver.get(self.url)
@@ -43,6 +46,7 @@ class Kraken(CaseDriverWprReplay):
 
 class PSPDFKit(CaseDriverWprReplay):
 	computes_score = True
+	needs_clean_browser = True
 
 	def case_run(self):
 		self.driver.get('https://pspdfkit.com/webassembly-benchmark/')
@@ -58,33 +62,27 @@ class PSPDFKit(CaseDriverWprReplay):
 		self.score = float(score.text)
 
 class BellardPCEmu(CaseDriverWprReplay):
+	needs_clean_browser = True
+
+	# pixels around the Start button of Windows 2000
+	start_button_box = (10, 750, 25, 752)
+	start_button_pixels = [
+		(212, 208, 200), (212, 208, 200), (0, 0, 0), (0, 0, 0), (0, 0, 0), (255, 0, 0), (0, 0, 0), (0, 0, 0),
+		(0, 255, 0), (0, 0, 0), (0, 0, 0), (0, 0, 0), (212, 208, 200), (212, 208, 200), (212, 208, 200),
+		(0, 0, 0), (0, 0, 0), (0, 0, 0), (0, 0, 0), (255, 0, 0), (255, 0, 0), (0, 0, 0), (0, 0, 0),
+		(0, 255, 0), (0, 255, 0), (0, 0, 0), (0, 0, 0), (212, 208, 200), (212, 208, 200), (212, 208, 200),
+	]
+
 	def case_run(self):
 		self.driver.get('https://bellard.org/jslinux/vm.html?url=win2k.cfg&mem=192&graphic=1&w=1024&h=768')
 
-		canvas = self.driver.wait_for_element('#term_container > canvas')
-		if not canvas:
+		selector = '#term_container > canvas'
+		if not self.driver.wait_for_element(selector):
 			return
 
-		sleep(30)
-
-		try:
-			from PIL import Image
-			from io import BytesIO
-
-			# 120 seconds to try to find Start button
-			time = 120
-			while time > 0:
-				sleep(5)
-				img = Image.open(BytesIO(canvas.screenshot_as_png))
-				img = img.crop((10, 750, 25, 752))
-				img = img.convert(mode='RGB')
-				if list(img.getdata()) == [(212, 208, 200), (212, 208, 200), (0, 0, 0), (0, 0, 0), (0, 0, 0), (255, 0, 0), (0, 0, 0), (0, 0, 0), (0, 255, 0), (0, 0, 0), (0, 0, 0), (0, 0, 0), (212, 208, 200), (212, 208, 200), (212, 208, 200), (0, 0, 0), (0, 0, 0), (0, 0, 0), (0, 0, 0), (255, 0, 0), (255, 0, 0), (0, 0, 0), (0, 0, 0), (0, 255, 0), (0, 255, 0), (0, 0, 0), (0, 0, 0), (212, 208, 200), (212, 208, 200), (212, 208, 200)]:
-					break
-				time -= 5
-		except (ImportError, ModuleNotFoundError) as e:
-			print(e)
-			# if we don't have PIL library, just wait 120 seconds
-			sleep(120)
+		# 150 seconds to boot and show the Start button
+		self.driver.wait_for_canvas_region(selector, self.start_button_box,
+						   region_hash(self.start_button_pixels), time=150)
 
 class YouTubeVideo(CaseDriverWprReplay):
 	def case_run(self):
@@ -98,11 +96,4 @@ class SpreadSheet(CaseDriverWprReplay):
 		self.driver.get('https://docs.google.com/spreadsheets/d/16jfsJs14QrWKhsbxpdJXgoYumxNpnDt08DTK82Puc2A/edit#gid=896027318&range=C:C')
 
 def all_cases():
-	return [
-		Aquarium(),
-		Kraken(),
-		PSPDFKit(),
-		BellardPCEmu(),
-		YouTubeVideo(),
-		SpreadSheet(),
-	]
+	return case_registry.cases_in_module(__name__)
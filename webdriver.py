@@ -7,9 +7,9 @@ from selenium.webdriver.common.by import By
 from selenium.common.exceptions import WebDriverException
 from selenium.webdriver.remote.webelement import WebElement
 from functools import wraps
-from time import sleep
+from time import sleep, monotonic
 
-__all__ = ['ProfilerWebDriver']
+__all__ = ['ProfilerWebDriver', 'region_hash']
 
 def repeat_on_error(err=Exception, to_sleep=1, contains=None, repeats=5):
 	def decorator(func):
@@ -28,6 +28,47 @@ def repeat_on_error(err=Exception, to_sleep=1, contains=None, repeats=5):
 
 	return decorator
 
+# FNV-1a hash of RGB pixel values, same as computed in the page by
+# ProfilerWebDriver.canvas_region_hash()
+def region_hash(pixels):
+	h = 0x811c9dc5
+	for pixel in pixels:
+		for value in pixel[:3]:
+			h = ((h ^ value) * 0x01000193) & 0xffffffff
+	return h
+
+# Reads RGB values of a canvas region in the page. Returns null if there is
+# no such canvas, else array of [r, g, b] arrays, or their FNV-1a hash if hash
+# is true. The region is always copied to a scratch canvas with drawImage()
+# and read from there: calling getContext() on the page's canvas would create
+# a 2d context on it if the page has not created its own (e.g. WebGL) yet,
+# and the page could then never get the context it wants.
+_read_canvas_region_js = '''
+var canvas = document.querySelector(arguments[0]);
+var x = arguments[1], y = arguments[2], w = arguments[3], h = arguments[4], hash = arguments[5];
+if (!canvas || !canvas.getContext)
+  return null;
+var copy = typeof OffscreenCanvas !== 'undefined' ? new OffscreenCanvas(w, h) : document.createElement('canvas');
+copy.width = w;
+copy.height = h;
+var ctx = copy.getContext('2d');
+ctx.drawImage(canvas, x, y, w, h, 0, 0, w, h);
+var data = ctx.getImageData(0, 0, w, h).data;
+var res = hash ? 0x811c9dc5 : [];
+for (var row = 0; row < h; row++) {
+  var off = row * w * 4;
+  for (var col = 0; col < w; col++, off += 4) {
+    if (hash) {
+      for (var i = 0; i < 3; i++)
+        res = Math.imul(res ^ data[off + i], 0x01000193) >>> 0;
+    } else {
+      res.push([data[off], data[off + 1], data[off + 2]]);
+    }
+  }
+}
+return res;
+'''
+
 repeat_on_unexpected = repeat_on_error(err=WebDriverException, contains='unexpected command response')
 
 class ProfilerWebElement(WebElement):
@@ -105,6 +146,34 @@ class ProfilerWebDriver(Chrome):
 
 		return elem
 
+	def clear_browser_cache(self):
+		self.execute_cdp_cmd('Network.clearBrowserCache', {})
+
+	# Returns list of (r, g, b) tuples of pixels in box (left, upper, right,
+	# lower) of canvas found by selector, read back in the page, or None if
+	# there is no such canvas
+	def read_canvas_region(self, selector, box):
+		x, y, right, lower = box
+		pixels = self.execute_script(_read_canvas_region_js, selector, x, y, right - x, lower - y, False)
+		if pixels is None:
+			return None
+		return [tuple(pixel) for pixel in pixels]
+
+	def canvas_region_hash(self, selector, box):
+		x, y, right, lower = box
+		return self.execute_script(_read_canvas_region_js, selector, x, y, right - x, lower - y, True)
+
+	# Waits until region_hash() of pixels in box of canvas found by selector
+	# equals expected_hash, polling every period seconds
+	def wait_for_canvas_region(self, selector, box, expected_hash, time=10, period=0.25):
+		deadline = monotonic() + time
+		while True:
+			if self.canvas_region_hash(selector, box) == expected_hash:
+				return True
+			if monotonic() >= deadline:
+				return False
+			sleep(period)
+
 	def open_in_new_tab(self, url):
 		old_handles = set(self.window_handles)
 
@@ -117,3 +186,13 @@ class ProfilerWebDriver(Chrome):
 		self.switch_to.window(win)
 
 		return win
+
+	def close_other_tabs(self):
+		current = self.current_window_handle
+
+		for handle in self.window_handles:
+			if handle != current:
+				self.switch_to.window(handle)
+				self.close()
+
+		self.switch_to.window(current)
@@ -16,6 +16,7 @@
 
 from time import sleep
 from case_drivers import CaseDriverWithHttpServer
+import case_registry
 
 class WebRTCBase(CaseDriverWithHttpServer):
 	directory='webrtc_cases'
@@ -155,20 +156,4 @@ class NegotiateTiming(WebRTCBase):
 		self.driver.wait_for_javascript_condition('!renegotiateButton.disabled')
 
 def all_cases():
-	return [
-		GetUserMedia(),
-		DataChannel(),
-		CanvasCapturePeerConnection(),
-		VideoCodecConstraints('VP8'),
-		VideoCodecConstraints('VP9'),
-		VideoCodecConstraints('H264'),
-		MultiplePeerConnections(),
-		PausePlayPeerConnections(),
-		InsertableStreamsAudioProcessing(),
-		InsertableStreamsVideoProcessing('camera', 'webgl', 'video'),
-		InsertableStreamsVideoProcessing('video', 'webgl', 'video'),
-		InsertableStreamsVideoProcessing('pc', 'webgl', 'video'),
-		InsertableStreamsVideoProcessing('camera', 'canvas2d', 'video'),
-		InsertableStreamsVideoProcessing('camera', 'noop', 'video'),
-		InsertableStreamsVideoProcessing('camera', 'webgl', 'pc'),
-	]
+	return case_registry.cases_in_module(__name__)
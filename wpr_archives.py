@@ -0,0 +1,145 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#
+# Copyright 2022 Marek Behún <kabel@kernel.org>
+#
+# Recording and verification of Web Page Replay archives in web-page-records.
+
+import gzip, hashlib, json, os, pathlib, threading
+from concurrent.futures import ThreadPoolExecutor
+
+__all__ = ['ARCHIVES_PATH', 'archive_path', 'checksum_path', 'has_checksum', 'ArchiveCache', 'verify_archives',
+	   'write_checksum', 'record_case']
+
+ARCHIVES_PATH = pathlib.Path(__file__).parent / 'web-page-records'
+# host specific, so kept out of the source tree (and release tarballs)
+CACHE_PATH = pathlib.Path(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')) / \
+	     'chromium-profiler' / 'wpr-verify-cache.json'
+
+def archive_path(name):
+	return ARCHIVES_PATH / (name + '.wprgo')
+
+def checksum_path(name):
+	return ARCHIVES_PATH / (name + '.wprgo.sha256sum')
+
+def has_checksum(name):
+	return checksum_path(name).is_file()
+
+def _sha256(path):
+	h = hashlib.sha256()
+	with open(path, 'rb') as f:
+		while True:
+			chunk = f.read(1 << 20)
+			if not chunk:
+				break
+			h.update(chunk)
+	return h.hexdigest()
+
+def _request_count(path):
+	# wpr archives are gzipped JSON with requests grouped by host and URL
+	with gzip.open(path, 'rb') as f:
+		archive = json.load(f)
+	return sum(len(requests) for urls in archive.get('Requests', {}).values() for requests in urls.values())
+
+# Cache of archive checksums and request counts, keyed by absolute archive path
+# and valid as long as size and mtime of the archive do not change
+class ArchiveCache:
+	def __init__(self, path=None):
+		self.path = path or CACHE_PATH
+		self._lock = threading.Lock()
+		try:
+			with open(self.path) as f:
+				self._entries = json.load(f)
+		except (OSError, ValueError):
+			self._entries = {}
+
+	def info(self, path, requests=False):
+		st = os.stat(path)
+		key = os.path.abspath(path)
+		stamp = [st.st_size, st.st_mtime_ns]
+
+		with self._lock:
+			entry = self._entries.get(key)
+		if entry is None or entry['stamp'] != stamp:
+			entry = {'stamp': stamp, 'sha256': _sha256(path), 'requests': None}
+		if requests and entry['requests'] is None:
+			try:
+				entry['requests'] = _request_count(path)
+			except (OSError, ValueError, EOFError):
+				entry['requests'] = -1
+
+		with self._lock:
+			self._entries[key] = entry
+
+		return {'size': st.st_size, 'sha256': entry['sha256'], 'requests': entry['requests']}
+
+	def save(self):
+		try:
+			os.makedirs(os.path.dirname(self.path), exist_ok=True)
+			with open(self.path, 'w') as f:
+				json.dump(self._entries, f)
+		except OSError:
+			pass
+
+def _verify(cache, name, requests):
+	try:
+		with open(checksum_path(name)) as f:
+			expected = f.read().split()[0]
+	except (OSError, IndexError):
+		return name, None, 'missing checksum'
+
+	path = archive_path(name)
+	if not path.is_file():
+		return name, None, 'missing archive'
+
+	info = cache.info(path, requests)
+	if info['sha256'] != expected:
+		return name, info, 'checksum mismatch'
+
+	return name, info, None
+
+# Verifies archives of cases names against their .sha256sum files,
+# concurrently. Returns list of (name, info, error) tuples, where info is
+# dictionary with size, sha256 and requests (None unless requests is True),
+# and error is None if the archive is OK.
+def verify_archives(names, jobs=None, requests=False):
+	cache = ArchiveCache()
+	with ThreadPoolExecutor(jobs or os.cpu_count()) as executor:
+		res = list(executor.map(lambda name: _verify(cache, name, requests), names))
+	cache.save()
+	return res
+
+def write_checksum(name):
+	with open(checksum_path(name), 'w') as f:
+		f.write('%s  %s\n' % (_sha256(archive_path(name)), archive_path(name).name))
+
+# Records archive for Web Page Replay case with name, keeping the old archive
+# if recording fails. Meant to be run in a worker process.
+def record_case(name):
+	import case_registry
+	from case_drivers import CaseDriverWprRecord
+
+	# same case, but with CaseDriverWprRecord backend
+	spec = case_registry.select_cases([name])[0]
+	replay_cls = spec.load().__class__
+	cls = type(replay_cls.__name__, (CaseDriverWprRecord, replay_cls), {'__module__': replay_cls.__module__})
+	case = cls(*spec.args, **spec.kwargs)
+
+	path = case.archive_path()
+	backup = path + '.old'
+	if os.path.exists(path):
+		os.rename(path, backup)
+
+	try:
+		case.run()
+		if not os.path.exists(path):
+			raise Exception('wpr did not write the archive')
+	except Exception as e:
+		if os.path.exists(backup):
+			os.replace(backup, path)
+		return name, repr(e)
+
+	if os.path.exists(backup):
+		os.unlink(backup)
+	write_checksum(name)
+
+	return name, None